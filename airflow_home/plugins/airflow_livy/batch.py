@@ -14,21 +14,63 @@ https://spark.apache.org/docs/latest/monitoring.html#rest-api
 https://hadoop.apache.org/docs/current/hadoop-yarn/hadoop-yarn-site/ResourceManagerRest.html
 """
 
+import atexit
+import functools
 import json
 import logging
+import random
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from json import JSONDecodeError
 from numbers import Number
 
-from airflow.exceptions import AirflowBadRequest, AirflowException
-from airflow.hooks.http_hook import HttpHook
-from airflow.models import BaseOperator
+import requests
+from airflow.exceptions import (
+    AirflowBadRequest,
+    AirflowException,
+    AirflowRescheduleException,
+)
+from airflow.hooks.base_hook import BaseHook
+from airflow.models import BaseOperator, TaskReschedule, Variable
 from airflow.sensors.base_sensor_operator import BaseSensorOperator
 from airflow.utils.decorators import apply_defaults
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 LIVY_ENDPOINT = "batches"
 SPARK_ENDPOINT = "api/v1/applications"
 YARN_ENDPOINT = "ws/v1/cluster/apps"
+# Endpoint templates are built once, they're filled on every poke and log page.
+BATCH_ENDPOINT = LIVY_ENDPOINT + "/%s"
+BATCH_LOG_ENDPOINT = LIVY_ENDPOINT + "/%s/log?from=%d&size=%d"
+SPARK_JOBS_ENDPOINT = SPARK_ENDPOINT + "/%s/jobs"
+YARN_APP_ENDPOINT = YARN_ENDPOINT + "/%s"
+SUBMIT_HEADERS = {"X-Requested-By": "airflow", "Content-Type": "application/json"}
 VERIFICATION_METHODS = ["spark", "yarn"]
+# Livy batch request body key -> LivyBatchOperator attribute.
+PAYLOAD_FIELDS = [
+    ("file", "file"),
+    ("proxyUser", "proxy_user"),
+    ("className", "class_name"),
+    ("args", "arguments"),
+    ("jars", "jars"),
+    ("pyFiles", "py_files"),
+    ("files", "files"),
+    ("driverMemory", "driver_memory"),
+    ("driverCores", "driver_cores"),
+    ("executorMemory", "executor_memory"),
+    ("executorCores", "executor_cores"),
+    ("numExecutors", "num_executors"),
+    ("archives", "archives"),
+    ("queue", "queue"),
+    ("name", "name"),
+    ("conf", "conf"),
+]
 VALID_BATCH_STATES = [
     "not_started",
     "starting",
@@ -38,25 +80,166 @@ VALID_BATCH_STATES = [
     "busy",
     "shutting_down",
 ]
+BACKOFF_RESET_STATES = ["not_started", "starting"]
+BACKOFF_MAX_INTERVAL_SEC = 60
+BACKOFF_JITTER = (0.7, 1.3)
+MIN_RESCHEDULE_INTERVAL_SEC = 60
+# Reschedules start at the floor above, so they need a higher cap to back off.
+BACKOFF_MAX_RESCHEDULE_INTERVAL_SEC = 5 * 60
+# Reschedule mode runs every poke on a new sensor instance, and Airflow clears
+# the task's XComs before each run, so the ETag is kept in a variable until the
+# sensor finishes.
+POKE_ETAG_VARIABLE = "livy_batch_etag__%s__%s__%s__%d"
+NOT_MODIFIED = 304
+TOO_MANY_REQUESTS = 429
+MAX_ERROR_RESPONSE_CHARS = 4096
 LOG_PAGE_LINES = 100
+# Each page is read and parsed whole, so these two bound the log lines held in
+# memory while spilling: up to LOG_FETCH_WORKERS pages of LOG_BULK_LINES.
+LOG_BULK_LINES = 1000
+LOG_FETCH_WORKERS = 4
+# (connect, read) seconds, so a half-open connection fails and gets retried.
+REQUEST_TIMEOUT_SEC = (10, 60)
+
+
+# orjson parses bytes directly and is several times faster than the standard
+# library, which is only used when it isn't installed.
+def _loads(data):
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def _dumps(obj):
+    return orjson.dumps(obj).decode() if orjson is not None else json.dumps(obj)
+
+
+# Pooled HTTP sessions keyed by Airflow connection id, shared by every operator
+# and sensor in this process so that polling and log paging reuse connections.
+_SESSIONS = {}
+# All sessions share one adapter: its pool manager keeps one pool per scheme,
+# host and port, so Livy, Spark and YARN behind the same gateway share
+# connections (and TLS handshakes) even though their connection ids differ.
+_ADAPTER = HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=20,
+    max_retries=Retry(
+        total=3,
+        backoff_factor=0.3,
+        status_forcelist=[502, 503, 504],
+        raise_on_status=False,
+    ),
+)
+
+
+@functools.lru_cache(maxsize=32)
+def _resolve_conn(conn_id):
+    # Same as HttpHook: login/password and JSON headers from the connection.
+    conn = BaseHook.get_connection(conn_id)
+    auth = (conn.login, conn.password) if conn.login else None
+    headers = conn.extra_dejson if conn.extra else {}
+    return get_base_url(conn), auth, headers
+
+
+def _get_session(conn_id):
+    if conn_id not in _SESSIONS:
+        base_url, auth, headers = _resolve_conn(conn_id)
+        session = requests.Session()
+        session.auth = auth
+        session.headers.update(headers)
+        # Same as HttpHook: certificates aren't verified.
+        session.verify = False
+        # Nor are REQUESTS_CA_BUNDLE or HTTP(S)_PROXY from the environment used,
+        # Session.request() would merge them in and override the above.
+        session.trust_env = False
+        session.mount("http://", _ADAPTER)
+        session.mount("https://", _ADAPTER)
+        _SESSIONS[conn_id] = (base_url, session)
+    return _SESSIONS[conn_id]
+
+
+def get_base_url(conn):
+    if conn.host and "://" in conn.host:
+        base_url = conn.host
+    else:
+        base_url = f"{conn.schema or 'http'}://{conn.host or ''}"
+    if conn.port:
+        base_url += f":{conn.port}"
+    # Endpoints are joined with a slash, e.g. for a host like https://gateway/livy/
+    return base_url.rstrip("/")
+
+
+def call_api(conn_id, method, endpoint, data=None, headers=None, allowed_codes=()):
+    base_url, session = _get_session(conn_id)
+    response = session.request(
+        method,
+        f"{base_url}/{endpoint}",
+        data=data,
+        headers=headers,
+        timeout=REQUEST_TIMEOUT_SEC,
+    )
+    if not response.ok and response.status_code not in allowed_codes:
+        logging.error(
+            f"HTTP error: {response.reason}\n"
+            f"{pretty_print_response(response)[:MAX_ERROR_RESPONSE_CHARS]}"
+        )
+        raise AirflowException(f"{response.status_code}:{response.reason}")
+    return response
+
+
+@atexit.register
+def close_sessions():
+    for _, session in _SESSIONS.values():
+        session.close()
+    _SESSIONS.clear()
 
 
 def log_response_error(lookup_path, response, batch_id=None):
     msg = "Can not parse JSON response."
     if batch_id is not None:
         msg += f" Batch id={batch_id}."
-    try:
-        pp_response = (
-            json.dumps(json.loads(response.content), indent=2)
-            if "application/json" in response.headers.get("Content-Type", "")
-            else response.content
-        )
-    except AttributeError:
-        pp_response = json.dumps(response, indent=2)
+    pp_response = pretty_print_response(response)
+    if len(pp_response) > MAX_ERROR_RESPONSE_CHARS:
+        pp_response = pp_response[:MAX_ERROR_RESPONSE_CHARS] + "\n...(truncated)"
     msg += f"\nTried to find JSON path: {lookup_path}, but response was:\n{pp_response}"
     logging.error(msg)
 
 
+def pretty_print_response(response):
+    try:
+        content_type = response.headers.get("Content-Type", "")
+    except AttributeError:
+        # Already parsed, e.g. a log page.
+        return json.dumps(response, indent=2)
+    if "application/json" in content_type:
+        try:
+            return json.dumps(_loads(response.content), indent=2)
+        except ValueError:
+            # Malformed JSON is what we're reporting, show it as is.
+            pass
+    # Don't decode more than we're going to print.
+    content = response.content or b""
+    return content[: MAX_ERROR_RESPONSE_CHARS + 1].decode("utf-8", errors="replace")
+
+
+def reschedule_interval(poke_interval, timeout):
+    # Each reschedule costs a round-trip through the scheduler and the DB.
+    if timeout < MIN_RESCHEDULE_INTERVAL_SEC:
+        raise AirflowException(
+            f"Reschedule mode checks at most every {MIN_RESCHEDULE_INTERVAL_SEC} "
+            f"sec., which is greater than the timeout value {timeout} sec. "
+            f"Timeout won't work, use mode='poke' instead."
+        )
+    return max(poke_interval, MIN_RESCHEDULE_INTERVAL_SEC)
+
+
+def poke_etag_variable(ti):
+    return POKE_ETAG_VARIABLE % (
+        ti.dag_id,
+        ti.task_id,
+        ti.execution_date.isoformat(),
+        ti.try_number,
+    )
+
+
 class LivyBatchSensor(BaseSensorOperator):
     def __init__(
         self,
@@ -66,7 +249,8 @@ class LivyBatchSensor(BaseSensorOperator):
         timeout=10 * 60,
         http_conn_id="livy",
         soft_fail=False,
-        mode="poke",
+        mode=None,
+        max_poke_interval=None,
     ):
         if poke_interval < 1:
             raise AirflowException(
@@ -78,6 +262,17 @@ class LivyBatchSensor(BaseSensorOperator):
                 f"Poke interval {poke_interval} sec. is greater "
                 f"than the timeout value {timeout} sec. Timeout won't work."
             )
+        if mode is None:
+            # Reschedule unless the timeout is too short for it.
+            mode = "reschedule" if timeout >= MIN_RESCHEDULE_INTERVAL_SEC else "poke"
+        if mode == "reschedule":
+            poke_interval = reschedule_interval(poke_interval, timeout)
+        if max_poke_interval is None:
+            max_poke_interval = (
+                BACKOFF_MAX_RESCHEDULE_INTERVAL_SEC
+                if mode == "reschedule"
+                else BACKOFF_MAX_INTERVAL_SEC
+            )
         super().__init__(
             poke_interval=poke_interval,
             timeout=timeout,
@@ -87,19 +282,67 @@ class LivyBatchSensor(BaseSensorOperator):
         )
         self.batch_id = batch_id
         self.http_conn_id = http_conn_id
+        self.base_poke_interval = poke_interval
+        self.max_poke_interval = max(poke_interval, max_poke_interval)
+        self.backoff_attempt = 0
+        self.batch_json = None
+        self.etag = None
+        self.stored_etag = None
+
+    def execute(self, context):
+        rescheduled = False
+        try:
+            super().execute(context)
+        except AirflowRescheduleException:
+            rescheduled = True
+            raise
+        finally:
+            if not rescheduled and self.stored_etag is not None:
+                Variable.delete(poke_etag_variable(context["ti"]))
 
     def poke(self, context):
+        # Without a task instance (poked outside of a task run) there's nowhere
+        # to keep the state, the instance attributes are used as in poke mode.
+        if not self.reschedule or "ti" not in context:
+            return self.check_batch()
+        self.load_poke_state(context["ti"])
+        finished = self.check_batch()
+        if not finished:
+            self.save_etag(context["ti"])
+        return finished
+
+    def check_batch(self):
         logging.info(f"Getting batch {self.batch_id} status...")
-        endpoint = f"{LIVY_ENDPOINT}/{self.batch_id}"
-        response = HttpHook(method="GET", http_conn_id=self.http_conn_id).run(endpoint)
+        endpoint = BATCH_ENDPOINT % self.batch_id
+        # Livy may answer 304 if the batch hasn't changed since the last poke.
+        headers = {"If-None-Match": self.etag} if self.etag else None
+        response = call_api(
+            self.http_conn_id,
+            "GET",
+            endpoint,
+            headers=headers,
+            allowed_codes=[TOO_MANY_REQUESTS],
+        )
+        if response.status_code in [NOT_MODIFIED, TOO_MANY_REQUESTS]:
+            self.backoff(grow=True)
+            logging.info(
+                f"No new status for batch {self.batch_id} "
+                f"(HTTP {response.status_code}), "
+                f"next check in {self.poke_interval:.1f} sec."
+            )
+            return False
+        self.etag = response.headers.get("ETag")
         try:
-            state = json.loads(response.content)["state"]
+            self.batch_json = _loads(response.content)
+            state = self.batch_json["state"]
         except (JSONDecodeError, LookupError) as ex:
             log_response_error("$.state", response, self.batch_id)
             raise AirflowBadRequest(ex)
         if state in VALID_BATCH_STATES:
+            self.backoff(grow=state not in BACKOFF_RESET_STATES)
             logging.info(
-                f"Batch {self.batch_id} has not finished yet (state is '{state}')"
+                f"Batch {self.batch_id} has not finished yet (state is '{state}'), "
+                f"next check in {self.poke_interval:.1f} sec."
             )
             return False
         if state == "success":
@@ -107,6 +350,35 @@ class LivyBatchSensor(BaseSensorOperator):
             return True
         raise AirflowException(f"Batch {self.batch_id} failed with state '{state}'")
 
+    def load_poke_state(self, ti):
+        # Every earlier poke of this try has been rescheduled, so they tell how far
+        # the backoff has got (unlike in poke mode, starting states don't reset it).
+        self.backoff_attempt = len(TaskReschedule.find_for_task_instance(ti))
+        if self.backoff_attempt:
+            self.stored_etag = Variable.get(poke_etag_variable(ti), default_var=None)
+            self.etag = self.stored_etag
+
+    def save_etag(self, ti):
+        if self.etag == self.stored_etag:
+            return
+        if self.etag is None:
+            Variable.delete(poke_etag_variable(ti))
+        else:
+            Variable.set(poke_etag_variable(ti), self.etag)
+        self.stored_etag = self.etag
+
+    def backoff(self, grow):
+        # Exponential backoff with jitter: doubles the interval on every poke while
+        # the batch is running, drops back to the base one while it's starting up.
+        self.backoff_attempt = self.backoff_attempt + 1 if grow else 0
+        interval = min(
+            self.max_poke_interval, self.base_poke_interval * 2 ** self.backoff_attempt
+        )
+        self.poke_interval = interval * random.uniform(*BACKOFF_JITTER)
+        if self.reschedule:
+            # Jitter mustn't bring reschedules below the floor set in __init__.
+            self.poke_interval = max(self.poke_interval, MIN_RESCHEDULE_INTERVAL_SEC)
+
 
 class LivyBatchOperator(BaseOperator):
     template_fields = ["name", "arguments"]
@@ -137,6 +409,7 @@ class LivyBatchOperator(BaseOperator):
         http_conn_id_spark="spark",
         http_conn_id_yarn="yarn",
         spill_logs=True,
+        close_on_success=True,
         *args,
         **kwargs,
     ):
@@ -170,25 +443,29 @@ class LivyBatchOperator(BaseOperator):
         self.http_conn_id_spark = http_conn_id_spark
         self.http_conn_id_yarn = http_conn_id_yarn
         self.spill_logs = spill_logs
+        self.close_on_success = close_on_success
         self.batch_id = None
 
     def execute(self, context):
         try:
             self.submit_batch()
             logging.info(f"Batch successfully submitted with id = {self.batch_id}.")
-            LivyBatchSensor(
+            sensor = LivyBatchSensor(
                 self.batch_id,
                 task_id=self.task_id,
                 http_conn_id=self.http_conn_id_livy,
                 poke_interval=self.poll_period_sec,
                 timeout=self.timeout_minutes * 60,
-            ).execute(context)
+                # Rescheduling would re-run this operator and submit another batch.
+                mode="poke",
+            )
+            sensor.execute(context)
             if self.verify_in in VERIFICATION_METHODS:
                 logging.info(
                     f"Additionally verifying status for batch id {self.batch_id} "
                     f"via {self.verify_in}..."
                 )
-                self.verify()
+                self.verify(sensor.batch_json)
         except Exception:
             if self.batch_id is not None:
                 self.spill_batch_logs()
@@ -199,38 +476,27 @@ class LivyBatchOperator(BaseOperator):
             if self.batch_id is not None:
                 if self.spill_logs:
                     self.spill_batch_logs()
-                self.close_batch()
+                # Some Livy setups reap finished batches themselves.
+                if self.close_on_success:
+                    self.close_batch()
 
     def submit_batch(self):
-        headers = {"X-Requested-By": "airflow", "Content-Type": "application/json"}
-        unfiltered_payload = {
-            "file": self.file,
-            "proxyUser": self.proxy_user,
-            "className": self.class_name,
-            "args": self.arguments,
-            "jars": self.jars,
-            "pyFiles": self.py_files,
-            "files": self.files,
-            "driverMemory": self.driver_memory,
-            "driverCores": self.driver_cores,
-            "executorMemory": self.executor_memory,
-            "executorCores": self.executor_cores,
-            "numExecutors": self.num_executors,
-            "archives": self.archives,
-            "queue": self.queue,
-            "name": self.name,
-            "conf": self.conf,
-        }
-        payload = {k: v for k, v in unfiltered_payload.items() if v}
-        logging.info(
-            f"Submitting the batch to Livy... "
-            f"Payload:\n{json.dumps(payload, indent=2)}"
-        )
-        response = HttpHook(http_conn_id=self.http_conn_id_livy).run(
-            LIVY_ENDPOINT, json.dumps(payload), headers
+        values = ((key, getattr(self, attr)) for key, attr in PAYLOAD_FIELDS)
+        payload = {key: value for key, value in values if value is not None}
+        if logging.getLogger().isEnabledFor(logging.INFO):
+            logging.info(
+                f"Submitting the batch to Livy... "
+                f"Payload:\n{json.dumps(payload, indent=2)}"
+            )
+        response = call_api(
+            self.http_conn_id_livy,
+            "POST",
+            LIVY_ENDPOINT,
+            _dumps(payload),
+            SUBMIT_HEADERS,
         )
         try:
-            batch_id = json.loads(response.content)["id"]
+            batch_id = _loads(response.content)["id"]
         except (JSONDecodeError, LookupError) as ex:
             log_response_error("$.id", response)
             raise AirflowBadRequest(ex)
@@ -241,8 +507,12 @@ class LivyBatchOperator(BaseOperator):
             )
         self.batch_id = batch_id
 
-    def verify(self):
-        app_id = self.get_spark_app_id(self.batch_id)
+    def verify(self, batch_json=None):
+        # The sensor has just fetched the finished batch, no need to ask Livy again.
+        if batch_json is not None and "appId" in batch_json:
+            app_id = batch_json["appId"]
+        else:
+            app_id = self.get_spark_app_id(self.batch_id)
         if app_id is None:
             raise AirflowException(f"Spark appId was null for batch {self.batch_id}")
         logging.info(f"Found app id '{app_id}' for batch id {self.batch_id}.")
@@ -254,49 +524,45 @@ class LivyBatchOperator(BaseOperator):
 
     def get_spark_app_id(self, batch_id):
         logging.info(f"Getting Spark app id from Livy API for batch {batch_id}...")
-        endpoint = f"{LIVY_ENDPOINT}/{batch_id}"
-        response = HttpHook(method="GET", http_conn_id=self.http_conn_id_livy).run(
-            endpoint
-        )
+        endpoint = BATCH_ENDPOINT % batch_id
+        response = call_api(self.http_conn_id_livy, "GET", endpoint)
         try:
-            return json.loads(response.content)["appId"]
+            return _loads(response.content)["appId"]
         except (JSONDecodeError, LookupError, AirflowException) as ex:
             log_response_error("$.appId", response, batch_id)
             raise AirflowBadRequest(ex)
 
     def check_spark_app_status(self, app_id):
         logging.info(f"Getting app status (id={app_id}) from Spark REST API...")
-        endpoint = f"{SPARK_ENDPOINT}/{app_id}/jobs"
-        response = HttpHook(method="GET", http_conn_id=self.http_conn_id_spark).run(
-            endpoint
-        )
+        endpoint = SPARK_JOBS_ENDPOINT % app_id
+        response = call_api(self.http_conn_id_spark, "GET", endpoint)
+        expected_status = "SUCCEEDED"
         try:
-            jobs = json.loads(response.content)
-            expected_status = "SUCCEEDED"
-            for job in jobs:
-                job_id = job["jobId"]
-                job_status = job["status"]
-                logging.info(
-                    f"Job id {job_id} associated with application '{app_id}' "
-                    f"is '{job_status}'"
-                )
-                if job_status != expected_status:
-                    raise AirflowException(
-                        f"Job id '{job_id}' associated with application '{app_id}' "
-                        f"is '{job_status}', expected status is '{expected_status}'"
-                    )
+            jobs = _loads(response.content)
+            failed_jobs = [
+                (job["jobId"], job["status"])
+                for job in jobs
+                if job["status"] != expected_status
+            ]
         except (JSONDecodeError, LookupError, TypeError) as ex:
             log_response_error("$.jobId, $.status", response)
             raise AirflowBadRequest(ex)
+        logging.info(
+            f"Application '{app_id}' has {len(jobs)} jobs, "
+            f"{len(failed_jobs)} of them are not '{expected_status}'"
+        )
+        if failed_jobs:
+            raise AirflowException(
+                f"Jobs associated with application '{app_id}' are not "
+                f"'{expected_status}' (job id, status): {failed_jobs}"
+            )
 
     def check_yarn_app_status(self, app_id):
         logging.info(f"Getting app status (id={app_id}) from YARN RM REST API...")
-        endpoint = f"{YARN_ENDPOINT}/{app_id}"
-        response = HttpHook(method="GET", http_conn_id=self.http_conn_id_yarn).run(
-            endpoint
-        )
+        endpoint = YARN_APP_ENDPOINT % app_id
+        response = call_api(self.http_conn_id_yarn, "GET", endpoint)
         try:
-            status = json.loads(response.content)["app"]["finalStatus"]
+            status = _loads(response.content)["app"]["finalStatus"]
         except (JSONDecodeError, LookupError, TypeError) as ex:
             log_response_error("$.app.finalStatus", response)
             raise AirflowBadRequest(ex)
@@ -309,44 +575,69 @@ class LivyBatchOperator(BaseOperator):
     def spill_batch_logs(self):
         dashes = 50
         logging.info(f"{'-'*dashes}Full log for batch {self.batch_id}{'-'*dashes}")
-        endpoint = f"{LIVY_ENDPOINT}/{self.batch_id}/log"
-        hook = HttpHook(method="GET", http_conn_id=self.http_conn_id_livy)
-        line_from = 0
-        line_to = LOG_PAGE_LINES
-        while True:
-            log_page = self.fetch_log_page(hook, endpoint, line_from, line_to)
-            try:
-                logs = log_page["log"]
-                for log in logs:
-                    logging.info(log.replace("\\n", "\n"))
-                actual_line_from = log_page["from"]
-                total_lines = log_page["total"]
-            except LookupError as ex:
-                log_response_error("$.log, $.from, $.total", log_page)
-                raise AirflowBadRequest(ex)
-            actual_lines = len(logs)
-            if actual_line_from + actual_lines >= total_lines:
-                logging.info(
-                    f"{'-' * dashes}End of full log for batch {self.batch_id}"
-                    f"{'-' * dashes}"
+        first_page = self.fetch_log_page(
+            self.http_conn_id_livy, self.batch_id, 0, LOG_PAGE_LINES
+        )
+        try:
+            line_from = first_page["from"] + len(first_page["log"])
+            total_lines = first_page["total"]
+        except LookupError as ex:
+            log_response_error("$.log, $.from, $.total", first_page)
+            raise AirflowBadRequest(ex)
+        self.print_log_page(first_page)
+        for log_page in self.fetch_remaining_log_pages(line_from, total_lines):
+            self.print_log_page(log_page)
+        logging.info(
+            f"{'-' * dashes}End of full log for batch {self.batch_id}{'-' * dashes}"
+        )
+
+    def fetch_remaining_log_pages(self, line_from, total_lines):
+        if line_from >= total_lines:
+            return
+        # Total is known now: fetch the rest in large pages, several at once.
+        # Pages are handed out in order as soon as they arrive, and no more than
+        # LOG_FETCH_WORKERS of them are held in memory at any time.
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=LOG_FETCH_WORKERS) as executor:
+            for page_from in range(line_from, total_lines, LOG_BULK_LINES):
+                if len(pending) == LOG_FETCH_WORKERS:
+                    yield pending.popleft().result()
+                pending.append(
+                    executor.submit(
+                        self.fetch_log_page,
+                        self.http_conn_id_livy,
+                        self.batch_id,
+                        page_from,
+                        min(LOG_BULK_LINES, total_lines - page_from),
+                    )
                 )
-                break
-            line_from = actual_line_from + actual_lines
+            while pending:
+                yield pending.popleft().result()
 
     @staticmethod
-    def fetch_log_page(hook: HttpHook, endpoint, line_from, line_to):
-        prepd_endpoint = endpoint + f"?from={line_from}&size={line_to}"
-        response = hook.run(prepd_endpoint)
+    def print_log_page(log_page):
         try:
-            return json.loads(response.content)
+            logs = log_page["log"]
+        except LookupError as ex:
+            log_response_error("$.log", log_page)
+            raise AirflowBadRequest(ex)
+        if logs:
+            # One record per page: per-line records are very slow for long logs.
+            # Unescape the whole page in one pass rather than line by line.
+            logging.info("\n".join(logs).replace("\\n", "\n"))
+
+    @staticmethod
+    def fetch_log_page(conn_id, batch_id, line_from, size):
+        endpoint = BATCH_LOG_ENDPOINT % (batch_id, line_from, size)
+        response = call_api(conn_id, "GET", endpoint)
+        try:
+            return _loads(response.content)
         except JSONDecodeError as ex:
             log_response_error("$", response)
             raise AirflowBadRequest(ex)
 
     def close_batch(self):
         logging.info(f"Closing batch with id = {self.batch_id}")
-        batch_endpoint = f"{LIVY_ENDPOINT}/{self.batch_id}"
-        HttpHook(method="DELETE", http_conn_id=self.http_conn_id_livy).run(
-            batch_endpoint
-        )
+        endpoint = BATCH_ENDPOINT % self.batch_id
+        call_api(self.http_conn_id_livy, "DELETE", endpoint)
         logging.info(f"Batch {self.batch_id} has been closed")
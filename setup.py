@@ -16,4 +16,6 @@ setup(
     packages=["airflow_livy"],
     package_dir={"airflow_livy": "airflow_home/plugins/airflow_livy"},
     python_requires=">=3.7",
+    # Faster JSON (de)serialization, the standard json module is used without it.
+    extras_require={"orjson": ["orjson>=2.6"]},
 )
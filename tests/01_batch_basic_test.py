@@ -2,13 +2,19 @@ import json
 
 from airflow import AirflowException
 from airflow.exceptions import AirflowBadRequest
-from airflow.hooks.http_hook import HttpHook
 from deepdiff import DeepDiff
 from pytest import mark, raises
 from requests import Response
+from requests.adapters import HTTPAdapter
 
-from airflow_home.plugins.airflow_livy.batch import LivyBatchOperator
+from airflow_home.plugins.airflow_livy.batch import (
+    REQUEST_TIMEOUT_SEC,
+    LivyBatchOperator,
+    _get_session,
+    call_api,
+)
 from tests.helpers import find_json_in_args, mock_http_calls
+from tests.mock_batches import URI, mock_batch_api_calls, mock_connection
 
 
 def test_jinja(dag):
@@ -38,10 +44,42 @@ def test_invalid_verification(dag):
     )
 
 
+def test_sessions_share_connection_pools(mocker):
+    mock_connection(mocker)
+    livy_url, livy_session = _get_session("livy")
+    spark_url, spark_session = _get_session("spark")
+    assert livy_url == spark_url == URI
+    assert livy_session is not spark_session
+    # Same host behind both connection ids, so the same pooled connections.
+    assert livy_session.get_adapter(URI) is spark_session.get_adapter(URI)
+
+
+def test_requests_time_out(mocker):
+    mock_connection(mocker)
+    http_response = mock_http_calls(200, content=b'{"id": 1}').send()
+    send = mocker.patch.object(HTTPAdapter, "send", return_value=http_response)
+    call_api("livy", "GET", "batches/1")
+    assert send.call_args[1]["timeout"] == REQUEST_TIMEOUT_SEC
+
+
+def test_requests_ignore_environment(mocker, monkeypatch):
+    monkeypatch.setenv("REQUESTS_CA_BUNDLE", "/etc/ssl/bundle.pem")
+    monkeypatch.setenv("HTTP_PROXY", "http://proxy:3128")
+    monkeypatch.setenv("HTTPS_PROXY", "http://proxy:3128")
+    mock_connection(mocker, host="https://gateway/livy/", port=None)
+    http_response = mock_http_calls(200, content=b'{"id": 1}').send()
+    send = mocker.patch.object(HTTPAdapter, "send", return_value=http_response)
+    call_api("livy", "GET", "batches/1")
+    request = send.call_args[0][0]
+    assert request.url == "https://gateway/livy/batches/1"
+    assert send.call_args[1]["verify"] is False
+    assert not send.call_args[1]["proxies"]
+
+
 def test_submit_batch_get_id(dag, mocker):
     op = LivyBatchOperator(task_id="test_submit_batch_get_id", dag=dag)
     http_response = mock_http_calls(201, content=b'{"id": 123}')
-    mocker.patch.object(HttpHook, "get_conn", return_value=http_response)
+    mock_batch_api_calls(mocker, http_response)
     op.submit_batch()
     assert op.batch_id == 123
 
@@ -81,7 +119,9 @@ def test_submit_batch_params(dag, mocker):
     )
     mock_response = Response()
     mock_response._content = b'{"id": 1}'
-    patched_hook = mocker.patch.object(HttpHook, "run", return_value=mock_response)
+    patched_hook = mocker.patch(
+        "airflow_home.plugins.airflow_livy.batch.call_api", return_value=mock_response
+    )
 
     op.submit_batch()
 
@@ -133,7 +173,7 @@ def test_submit_batch_params(dag, mocker):
     actual_json = find_json_in_args(actual_args, actual_kwargs)
     if actual_json is None:
         raise AssertionError(
-            f"Can not find JSON in HttpHook args.\n"
+            f"Can not find JSON in call_api args.\n"
             f"Args:\n{actual_args}\n"
             f"KWArgs (JSON should be under 'data' key):\n{actual_kwargs}"
         )
@@ -144,13 +184,32 @@ def test_submit_batch_params(dag, mocker):
         assert not diff
 
 
+def test_submit_batch_skips_only_none_params(dag, mocker):
+    op = LivyBatchOperator(
+        file="file",
+        arguments=[],
+        num_executors=0,
+        task_id="test_submit_batch_skips_only_none_params",
+        dag=dag,
+    )
+    mock_response = Response()
+    mock_response._content = b'{"id": 1}'
+    patched_hook = mocker.patch(
+        "airflow_home.plugins.airflow_livy.batch.call_api", return_value=mock_response
+    )
+    op.submit_batch()
+    actual_args, actual_kwargs = patched_hook._call_matcher(patched_hook.call_args)
+    actual_json = find_json_in_args(actual_args, actual_kwargs)
+    assert actual_json == {"file": "file", "args": [], "numExecutors": 0}
+
+
 @mark.parametrize("code", [404, 403, 500, 503, 504])
 def test_submit_batch_bad_response_codes(dag, mocker, code):
     op = LivyBatchOperator(task_id="test_submit_batch_bad_response_codes", dag=dag)
     http_response = mock_http_calls(
         code, content=b"Error content", reason="Good reason"
     )
-    mocker.patch.object(HttpHook, "get_conn", return_value=http_response)
+    mock_batch_api_calls(mocker, http_response)
     with raises(AirflowException) as ae:
         op.submit_batch()
     print(
@@ -162,7 +221,7 @@ def test_submit_batch_bad_response_codes(dag, mocker, code):
 def test_submit_batch_malformed_json(dag, mocker):
     op = LivyBatchOperator(task_id="test_submit_batch_malformed_json", dag=dag)
     http_response = mock_http_calls(201, content=b'{"id":{}')
-    mocker.patch.object(HttpHook, "get_conn", return_value=http_response)
+    mock_batch_api_calls(mocker, http_response)
     with raises(AirflowBadRequest) as bre:
         op.submit_batch()
     print(
@@ -171,10 +230,29 @@ def test_submit_batch_malformed_json(dag, mocker):
     )
 
 
+def test_submit_batch_malformed_json_content_type(dag, mocker, caplog):
+    op = LivyBatchOperator(
+        task_id="test_submit_batch_malformed_json_content_type", dag=dag
+    )
+    http_response = mock_http_calls(201, content=b'{"id":{}' + b" " * 10000)
+    http_response.send.return_value.headers = {"Content-Type": "application/json"}
+    mock_batch_api_calls(mocker, http_response)
+    with raises(AirflowBadRequest) as bre:
+        op.submit_batch()
+    print(
+        f"\n\nImitated malformed JSON response with JSON content type, "
+        f"got the expected exception:\n<{bre.value}>"
+    )
+    error = caplog.records[-1].message
+    assert '{"id":{}' in error
+    assert error.endswith("...(truncated)")
+    assert len(error) < 4096 + 200
+
+
 def test_submit_batch_string_id(dag, mocker):
     op = LivyBatchOperator(task_id="test_submit_batch_string_id", dag=dag)
     http_response = mock_http_calls(201, content=b'{"id":"unexpectedly, a string!"}')
-    mocker.patch.object(HttpHook, "get_conn", return_value=http_response)
+    mock_batch_api_calls(mocker, http_response)
     with raises(AirflowException) as ae:
         op.submit_batch()
     print(
@@ -1,25 +1,39 @@
+from datetime import datetime
+from unittest.mock import Mock
+
+import responses
 from airflow import AirflowException
-from airflow.exceptions import AirflowBadRequest, AirflowSensorTimeout
-from airflow.hooks.http_hook import HttpHook
+from airflow.exceptions import (
+    AirflowBadRequest,
+    AirflowRescheduleException,
+    AirflowSensorTimeout,
+)
+from airflow.models import TaskReschedule, Variable
+from airflow.utils import timezone
 from pytest import mark, raises
 
 from airflow_home.plugins.airflow_livy.batch import LivyBatchSensor
 from tests.helpers import mock_http_calls
+from tests.mock_batches import URI, mock_batch_api_calls, mock_connection
 
 
 def test_batch_sensor(mocker):
-    sen = LivyBatchSensor(batch_id=2, task_id="test_batch_sensor")
+    sen = LivyBatchSensor(batch_id=2, task_id="test_batch_sensor", mode="poke")
     http_response = mock_http_calls(200, content=b'{"id": 2, "state": "success"}',)
-    mocker.patch.object(HttpHook, "get_conn", return_value=http_response)
+    mock_batch_api_calls(mocker, http_response)
     sen.execute({})
 
 
 def test_batch_sensor_timeout(mocker):
     sen = LivyBatchSensor(
-        batch_id=2, task_id="test_batch_sensor_timeout", poke_interval=1, timeout=2,
+        batch_id=2,
+        task_id="test_batch_sensor_timeout",
+        poke_interval=1,
+        timeout=2,
+        mode="poke",
     )
     http_response = mock_http_calls(200, content=b'{"id": 2, "state": "starting"}')
-    mocker.patch.object(HttpHook, "get_conn", return_value=http_response)
+    mock_batch_api_calls(mocker, http_response)
     with raises(AirflowSensorTimeout) as te:
         sen.execute({})
     assert 2 <= http_response.send.call_count <= 4
@@ -30,8 +44,174 @@ def test_batch_sensor_timeout(mocker):
     )
 
 
+def test_batch_sensor_backoff(mocker):
+    sen = LivyBatchSensor(
+        batch_id=2,
+        task_id="test_batch_sensor_backoff",
+        poke_interval=5,
+        timeout=600,
+        mode="poke",
+    )
+    running = mock_http_calls(200, content=b'{"id": 2, "state": "running"}')
+    mock_batch_api_calls(mocker, running)
+    intervals = []
+    for _ in range(6):
+        assert not sen.poke({})
+        intervals.append(sen.poke_interval)
+    print(f"\n\nPoke intervals while batch is running: {intervals}")
+    for attempt, interval in enumerate(intervals, start=1):
+        expected = min(60, 5 * 2 ** attempt)
+        assert 0.7 * expected <= interval <= 1.3 * expected
+
+    running.send.return_value._content = b'{"id": 2, "state": "starting"}'
+    assert not sen.poke({})
+    assert 0.7 * 5 <= sen.poke_interval <= 1.3 * 5
+
+
+def test_batch_sensor_backoff_when_throttled(mocker):
+    sen = LivyBatchSensor(
+        batch_id=2,
+        task_id="test_batch_sensor_backoff_when_throttled",
+        poke_interval=5,
+        mode="poke",
+    )
+    http_response = mock_http_calls(429, content=b"Slow down", reason="Throttled")
+    mock_batch_api_calls(mocker, http_response)
+    assert not sen.poke({})
+    assert 0.7 * 10 <= sen.poke_interval <= 1.3 * 10
+    assert not sen.poke({})
+    assert 0.7 * 20 <= sen.poke_interval <= 1.3 * 20
+
+
+@responses.activate
+def test_batch_sensor_not_modified(mocker):
+    mock_connection(mocker)
+    url = f"{URI}/batches/2"
+    responses.add(
+        responses.GET,
+        url,
+        json={"id": 2, "state": "running"},
+        headers={"ETag": '"v1"'},
+    )
+    responses.add(responses.GET, url, status=304)
+    sen = LivyBatchSensor(
+        batch_id=2,
+        task_id="test_batch_sensor_not_modified",
+        poke_interval=5,
+        mode="poke",
+    )
+    assert not sen.poke({})
+    assert not sen.poke({})
+    assert "If-None-Match" not in responses.calls[0].request.headers
+    assert responses.calls[1].request.headers["If-None-Match"] == '"v1"'
+    assert sen.batch_json["state"] == "running"
+    assert 0.7 * 20 <= sen.poke_interval <= 1.3 * 20
+
+
+@responses.activate
+def test_batch_sensor_keeps_state_across_reschedules(mocker):
+    mock_connection(mocker)
+    reschedules = []
+    mocker.patch.object(
+        TaskReschedule, "find_for_task_instance", side_effect=lambda ti: reschedules
+    )
+    variables = {}
+    mocker.patch.object(
+        Variable,
+        "get",
+        side_effect=lambda key, default_var: variables.get(key, default_var),
+    )
+    mocker.patch.object(Variable, "set", side_effect=variables.__setitem__)
+    mocker.patch.object(Variable, "delete", side_effect=variables.pop)
+    url = f"{URI}/batches/2"
+    responses.add(
+        responses.GET,
+        url,
+        json={"id": 2, "state": "running"},
+        headers={"ETag": '"v1"'},
+    )
+    responses.add(responses.GET, url, status=304)
+    responses.add(responses.GET, url, status=304)
+    responses.add(responses.GET, url, json={"id": 2, "state": "success"})
+    ti = Mock(
+        dag_id="dag",
+        task_id="test_batch_sensor_keeps_state_across_reschedules",
+        execution_date=datetime(2020, 1, 1),
+        try_number=1,
+    )
+    intervals = []
+    for _ in range(3):
+        # Every reschedule runs the poke on a new sensor instance.
+        sen = LivyBatchSensor(batch_id=2, task_id=ti.task_id)
+        with raises(AirflowRescheduleException):
+            sen.execute({"ti": ti})
+        intervals.append(sen.poke_interval)
+        reschedules.append(Mock(start_date=timezone.utcnow()))
+        assert list(variables.values()) == ['"v1"']
+    print(f"\n\nReschedule intervals while batch is running: {intervals}")
+    for attempt, interval in enumerate(intervals, start=1):
+        expected = min(300, 60 * 2 ** attempt)
+        assert 0.7 * expected <= interval <= 1.3 * expected
+    assert "If-None-Match" not in responses.calls[0].request.headers
+    assert responses.calls[1].request.headers["If-None-Match"] == '"v1"'
+    assert responses.calls[2].request.headers["If-None-Match"] == '"v1"'
+
+    LivyBatchSensor(batch_id=2, task_id=ti.task_id).execute({"ti": ti})
+    # Nothing is left behind once the sensor has finished.
+    assert not variables
+
+
+def test_batch_sensor_reschedule_by_default(mocker):
+    sen = LivyBatchSensor(
+        batch_id=2, task_id="test_batch_sensor_reschedule_by_default", poke_interval=5
+    )
+    assert sen.mode == "reschedule"
+    # Too frequent reschedules would only load the scheduler.
+    assert sen.poke_interval == 60
+    # Jitter doesn't bring it back below the floor either.
+    mocker.patch("random.uniform", return_value=0.7)
+    sen.backoff(grow=False)
+    assert sen.poke_interval == 60
+    # Still backs off from there, up to 5 minutes.
+    mocker.patch("random.uniform", return_value=1)
+    intervals = []
+    for _ in range(4):
+        sen.backoff(grow=True)
+        intervals.append(sen.poke_interval)
+    assert intervals == [120, 240, 300, 300]
+    sen = LivyBatchSensor(
+        batch_id=2, task_id="test_batch_sensor_poke_mode", poke_interval=5, mode="poke"
+    )
+    assert sen.poke_interval == 5
+
+
+def test_batch_sensor_short_timeout():
+    # Too short to reschedule, so the default falls back to poking.
+    sen = LivyBatchSensor(
+        batch_id=2,
+        task_id="test_batch_sensor_short_timeout",
+        poke_interval=20,
+        timeout=45,
+    )
+    assert sen.mode == "poke"
+    assert sen.poke_interval == 20
+    with raises(AirflowException) as ae:
+        LivyBatchSensor(
+            batch_id=2,
+            task_id="test_batch_sensor_short_timeout_reschedule",
+            poke_interval=20,
+            timeout=45,
+            mode="reschedule",
+        )
+    assert "at most every 60 sec." in str(ae.value)
+    print(
+        f"\n\nSet up the batch sensor to reschedule with a short timeout, "
+        f"got the expected exception:\n<{ae.value}>"
+    )
+
+
 @mark.parametrize(
-    "poke_interval,timeout", [(0, 0), (0, 1), (1, 0), (10, 0), (10, 1), (1000, 2)]
+    "poke_interval,timeout", [(0, 0), (0, 1), (1, 0), (10, 0), (10, 1), (1000, 2)],
 )
 def test_batch_sensor_invalid_timings(poke_interval, timeout):
     print(
@@ -66,7 +246,7 @@ def test_batch_sensor_invalid_timings(poke_interval, timeout):
 def test_batch_sensor_valid_states(mocker, state):
     sen = LivyBatchSensor(batch_id=2, task_id="test_batch_sensor_valid_states")
     http_response = mock_http_calls(200, content=f'{{"id": 2, "state": "{state}"}}')
-    mocker.patch.object(HttpHook, "get_conn", return_value=http_response)
+    mock_batch_api_calls(mocker, http_response)
     assert not sen.poke({})
 
 
@@ -76,7 +256,7 @@ def test_batch_sensor_valid_states(mocker, state):
 def test_batch_sensor_invalid_states(dag, mocker, state):
     sen = LivyBatchSensor(batch_id=2, task_id="test_batch_sensor_invalid_states")
     http_response = mock_http_calls(200, content=f'{{"id": 2, "state": "{state}"}}')
-    mocker.patch.object(HttpHook, "get_conn", return_value=http_response)
+    mock_batch_api_calls(mocker, http_response)
     with raises(AirflowException) as ae:
         sen.poke({})
     print(
@@ -88,7 +268,7 @@ def test_batch_sensor_invalid_states(dag, mocker, state):
 def test_batch_sensor_malformed_json(mocker):
     sen = LivyBatchSensor(batch_id=2, task_id="test_batch_sensor_malformed_json")
     http_response = mock_http_calls(200, content=f'{{"id": 2, "state": }}')
-    mocker.patch.object(HttpHook, "get_conn", return_value=http_response)
+    mock_batch_api_calls(mocker, http_response)
     with raises(AirflowBadRequest) as bre:
         sen.poke({})
     print(
@@ -103,7 +283,7 @@ def test_batch_sensor_bad_response_codes(mocker, code):
     http_response = mock_http_calls(
         code, content=b"Error content", reason="Good reason"
     )
-    mocker.patch.object(HttpHook, "get_conn", return_value=http_response)
+    mock_batch_api_calls(mocker, http_response)
     with raises(AirflowException) as ae:
         sen.poke({})
     print(
@@ -1,3 +1,5 @@
+import json
+
 import requests
 import responses
 from airflow import AirflowException
@@ -5,9 +7,10 @@ from airflow.hooks.base_hook import BaseHook
 from airflow.models import Connection
 from pytest import mark, raises
 
+from airflow_home.plugins.airflow_livy import batch
 from airflow_home.plugins.airflow_livy.batch import LivyBatchOperator
 from tests.helpers import MockedResponse
-from tests.mock_batches import mock_livy_batch_responses
+from tests.mock_batches import BATCH_ID, mock_livy_batch_responses
 
 
 @responses.activate
@@ -30,6 +33,56 @@ def test_run_batch_successfully(dag, mocker):
     spill_logs_spy.assert_called_once()
 
 
+@responses.activate
+def test_run_batch_without_orjson(dag, mocker, monkeypatch):
+    monkeypatch.setattr(batch, "orjson", None)
+    loads_spy = mocker.spy(json, "loads")
+    dumps_spy = mocker.spy(json, "dumps")
+    op = LivyBatchOperator(
+        spill_logs=True, task_id="test_run_batch_without_orjson", dag=dag
+    )
+    mock_livy_batch_responses(mocker, log_lines=321)
+    op.execute({})
+    # Falls back to the standard library for the payload, status and logs alike.
+    dumps_spy.assert_called()
+    assert loads_spy.call_count >= 3
+    assert op.batch_id == BATCH_ID
+
+
+@responses.activate
+def test_run_batch_close_on_success(dag, mocker):
+    op = LivyBatchOperator(
+        close_on_success=False, task_id="test_run_batch_close_on_success", dag=dag
+    )
+    close_batch_spy = mocker.spy(op, "close_batch")
+    mock_livy_batch_responses(mocker)
+    op.execute({})
+    # Batch succeeded and we were asked to leave it to Livy.
+    close_batch_spy.assert_not_called()
+
+    responses.reset()
+    mock_livy_batch_responses(
+        mocker, mock_get=[MockedResponse(200, json_body={"state": "dead"})]
+    )
+    with raises(AirflowException):
+        op.execute({})
+    # Failed batches are always closed.
+    close_batch_spy.assert_called_once()
+
+
+@responses.activate
+def test_run_batch_resolves_connections_once(dag, mocker):
+    mock_livy_batch_responses(mocker)
+    for i in range(3):
+        LivyBatchOperator(
+            verify_in="yarn",
+            task_id=f"test_run_batch_resolves_connections_once_{i}",
+            dag=dag,
+        ).execute({})
+    # One lookup per connection id (livy, yarn), no matter how many calls.
+    assert BaseHook._get_connections_from_db.call_count == 2
+
+
 def test_run_batch_error_before_batch_created(dag, mocker):
     op = LivyBatchOperator(
         spill_logs=True, task_id="test_run_batch_error_before_batch_created", dag=dag,
@@ -84,9 +137,38 @@ def test_run_batch_verify_in_spark(dag, mocker):
         dag=dag,
     )
     spark_checker_spy = mocker.spy(op, "check_spark_app_status")
+    app_id_getter_spy = mocker.spy(op, "get_spark_app_id")
     mock_livy_batch_responses(mocker)
     op.execute({})
     spark_checker_spy.assert_called_once()
+    # appId is taken from the last batch status response, not requested again.
+    app_id_getter_spy.assert_not_called()
+
+
+@responses.activate
+@mark.parametrize("state", ["dead", "killed", "error"])
+def test_run_batch_failed_skips_verification(dag, mocker, state):
+    op = LivyBatchOperator(
+        verify_in="spark",
+        spill_logs=False,
+        task_id="test_run_batch_failed_skips_verification",
+        dag=dag,
+    )
+    spill_logs_spy = mocker.spy(op, "spill_batch_logs")
+    verify_spy = mocker.spy(op, "verify")
+    mock_livy_batch_responses(
+        mocker, mock_get=[MockedResponse(200, json_body={"state": state})]
+    )
+    with raises(AirflowException) as ae:
+        op.execute({})
+    print(
+        f"\n\nImitated batch in '{state}' state, "
+        f"got the expected exception:\n<{ae.value}>"
+    )
+    # Livy state is final here, Spark REST API isn't asked.
+    verify_spy.assert_not_called()
+    assert not [c for c in responses.calls if "/api/v1/" in c.request.url]
+    spill_logs_spy.assert_called_once()
 
 
 @responses.activate
@@ -265,7 +347,8 @@ def test_run_batch_logs_multiple_of_page_size(dag, mocker):
     fetch_log_page_spy = mocker.spy(op, "fetch_log_page")
     mock_livy_batch_responses(mocker, log_lines=300)
     op.execute({})
-    assert fetch_log_page_spy.call_count == 3
+    # First page tells the total, the remaining 200 lines come in one request.
+    assert fetch_log_page_spy.call_count == 2
 
 
 @responses.activate
@@ -276,7 +359,63 @@ def test_run_batch_logs_greater_than_page_size(dag, mocker):
     fetch_log_page_spy = mocker.spy(op, "fetch_log_page")
     mock_livy_batch_responses(mocker, log_lines=321)
     op.execute({})
-    assert fetch_log_page_spy.call_count == 4
+    assert fetch_log_page_spy.call_count == 2
+
+
+@responses.activate
+def test_run_batch_logs_greater_than_bulk_size(dag, mocker):
+    op = LivyBatchOperator(
+        spill_logs=True, task_id="test_run_batch_logs_greater_than_bulk_size", dag=dag,
+    )
+    fetch_log_page_spy = mocker.spy(op, "fetch_log_page")
+    mock_livy_batch_responses(mocker, log_lines=12345)
+    op.execute({})
+    # 100 lines in the first page, then 12 x 1000 + 245.
+    assert fetch_log_page_spy.call_count == 14
+
+
+@responses.activate
+def test_run_batch_logs_keep_order(dag, mocker, caplog):
+    op = LivyBatchOperator(
+        spill_logs=True, task_id="test_run_batch_logs_keep_order", dag=dag,
+    )
+    mock_livy_batch_responses(mocker, log_lines=12345)
+    op.execute({})
+    log_pages = [r.message for r in caplog.records if "Log line" in r.message]
+    assert len(log_pages) == 14
+    log_lines = "\n".join(log_pages).split("\n")
+    assert log_lines == [f"--> Log line {n} <--" for n in range(12345)]
+
+
+@responses.activate
+def test_run_batch_logs_bounded_pages_in_memory(dag, mocker):
+    op = LivyBatchOperator(
+        spill_logs=True, task_id="test_run_batch_logs_bounded_pages_in_memory", dag=dag,
+    )
+    mock_livy_batch_responses(mocker, log_lines=100 + 1000 * 20)
+    fetch_log_page_spy = mocker.spy(op, "fetch_log_page")
+    printed_at_fetch_count = []
+    mocker.patch.object(
+        op,
+        "print_log_page",
+        side_effect=lambda _: printed_at_fetch_count.append(
+            fetch_log_page_spy.call_count
+        ),
+    )
+    op.batch_id = BATCH_ID
+    op.spill_batch_logs()
+    assert len(printed_at_fetch_count) == 21
+    # The first bulk page is printed before the 6th one is even requested.
+    assert printed_at_fetch_count[1] <= 1 + 4 + 1
+
+
+def test_print_log_page_unescapes_newlines(caplog):
+    LivyBatchOperator.print_log_page(
+        {"log": ["stdout: ", "line 1\\nline 2", "\\n", "last \\\\ line"]}
+    )
+    assert caplog.records[-1].message == (
+        "stdout: \nline 1\nline 2\n\n\nlast \\\\ line"
+    )
 
 
 @responses.activate
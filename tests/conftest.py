@@ -3,6 +3,11 @@ from datetime import datetime
 from airflow import DAG
 from pytest import fixture
 
+from airflow_home.plugins.airflow_livy.batch import (
+    _resolve_conn,
+    close_sessions,
+)
+
 
 @fixture(scope="session", autouse=True)
 def welcome():
@@ -14,3 +19,12 @@ def welcome():
 @fixture(scope="session")
 def dag():
     yield DAG("test_dag", start_date=datetime(1970, 1, 1))
+
+
+@fixture(autouse=True)
+def fresh_http_sessions():
+    yield
+    # Connections and sessions are cached per connection id,
+    # don't leak mocks between tests.
+    close_sessions()
+    _resolve_conn.cache_clear()
@@ -4,6 +4,7 @@ from unittest.mock import Mock
 import responses
 from airflow.hooks.base_hook import BaseHook
 from airflow.models import Connection
+from requests import Session
 
 from tests.helpers import LogMocker, MockedResponse
 
@@ -30,10 +31,19 @@ def mock_livy_batch_responses(
     _mock_yarn_response(mock_yarn)
     _mock_log_response(log_override_response, log_lines)
     _mock_delete_response(mock_delete)
+    mock_connection(mocker)
+
+
+def mock_batch_api_calls(mocker: Mock, http_response: Mock):
+    mocker.patch.object(Session, "send", http_response.send)
+    mock_connection(mocker)
+
+
+def mock_connection(mocker: Mock, host=HOST, port=PORT):
     mocker.patch.object(
         BaseHook,
         "_get_connections_from_db",
-        return_value=[Connection(host=HOST, port=PORT)],
+        return_value=[Connection(host=host, port=port)],
     )
 
 